@@ -1,6 +1,18 @@
+import hashlib
+import inspect
+import io
+import re
+
+import numpy as np
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from pandas.tseries.api import guess_datetime_format
+
+try:
+    from ahocorasick import Automaton
+except ImportError:  # fall back to one regex scan per category
+    Automaton = None
 
 st.title('Personal Finance Dashboard')
 st.write('Upload your bank statement as a CSV file.')
@@ -13,6 +25,235 @@ CATEGORY_KEYWORDS = {
     'Utilities': ['electric', 'water', 'internet', 'phone'],
     'Uncategorized': []
 }
+# Keep sidebar edits across reruns; the cached matchers are keyed on the table's
+# contents, so they are rebuilt only when a category or keyword is actually added
+CATEGORY_KEYWORDS = st.session_state.setdefault('category_keywords', CATEGORY_KEYWORDS)
+
+# --- Categorization ---
+def keyword_signature(category_keywords):
+    # Hashable snapshot of the table for the cache keys, lowercased once here because
+    # the matchers scan lowercased text; its order sets category precedence
+    return tuple((cat, tuple(kw.lower() for kw in kws)) for cat, kws in category_keywords.items())
+
+
+def prune_keywords(keyword_items):
+    # A keyword containing one from the same or an earlier category can never decide
+    # a match, so leave it out of the matcher
+    kept = []
+    pruned = []
+    for category, keywords in keyword_items:
+        own = []
+        for keyword in sorted(set(keywords), key=len):
+            if not any(k in keyword for k in kept + own):
+                own.append(keyword)
+        kept.extend(own)
+        pruned.append((category, tuple(own)))
+    return tuple(pruned)
+
+
+@st.cache_resource(max_entries=16)
+def build_automaton(keyword_items):
+    # Shared by every session, so keep only recent keyword tables.
+    # Each keyword maps to its category's rank, which is also its code in the output
+    automaton = Automaton()
+    for rank, (_, keywords) in enumerate(keyword_items):
+        for keyword in keywords:
+            if keyword not in automaton:
+                automaton.add_word(keyword, rank)
+    if len(automaton):
+        automaton.make_automaton()
+    return automaton
+
+
+def categorize(details, automaton, default):
+    # The lowest matched rank is the earliest category in the table
+    if not len(automaton):
+        return default
+    return min((rank for _, rank in automaton.iter(details)), default=default)
+
+
+@st.cache_resource(max_entries=16)
+def build_patterns(keyword_items):
+    # Plain pattern strings let pandas hand the scan to Arrow's regex kernel
+    return {rank: '|'.join(map(re.escape, keywords))
+            for rank, (_, keywords) in enumerate(keyword_items) if keywords}
+
+
+def categorize_column(details, keyword_items):
+    # Expects the lowercased Details column built by load_and_clean
+    dtype = pd.CategoricalDtype([category for category, _ in keyword_items])
+    if isinstance(details.dtype, pd.CategoricalDtype):
+        # Match each distinct description once, then broadcast the result through the codes
+        codes = match_keywords(pd.Series(details.cat.categories), keyword_items, dtype)
+        codes = codes[details.cat.codes.to_numpy()]
+    else:
+        codes = match_keywords(details, keyword_items, dtype)
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), index=details.index)
+
+
+def match_keywords(details, keyword_items, dtype):
+    # Returns category codes, never building a column of Python strings
+    keyword_items = prune_keywords(keyword_items)
+    uncategorized = dtype.categories.get_loc('Uncategorized')
+    code_type = np.int8 if len(dtype.categories) <= np.iinfo(np.int8).max else np.int32
+    if Automaton is not None:
+        automaton = build_automaton(keyword_items)
+        return np.fromiter((categorize(text, automaton, uncategorized) for text in details.to_numpy()),
+                           dtype=code_type, count=len(details))
+    # Fill codes column-at-a-time, earlier categories taking precedence
+    codes = np.full(len(details), uncategorized, dtype=code_type)
+    unmatched = np.ones(len(details), dtype=bool)
+    for rank, pattern in build_patterns(keyword_items).items():
+        mask = unmatched & details.str.contains(pattern, na=False).to_numpy(dtype=bool)
+        codes[mask] = rank
+        unmatched &= ~mask
+    return codes
+
+# --- Loading and Cleaning ---
+REQUIRED_COLS = ['Date', 'Details', 'Amount', 'Debit/Credit']
+REQUIRED = frozenset(REQUIRED_COLS)
+CHUNK_SIZE = 65_536
+
+
+class MissingColumnsError(ValueError):
+    def __init__(self, columns):
+        super().__init__(f"Missing required columns: {', '.join(columns)}")
+        self.columns = columns
+
+
+def check_columns(columns):
+    missing = REQUIRED - set(columns)
+    if missing:
+        raise MissingColumnsError([col for col in REQUIRED_COLS if col in missing])
+
+
+def guess_date_format(dates):
+    # Infer the format from the first date in the file, as a single to_datetime call
+    # over the whole column would, so every chunk parses dates the same way; None
+    # until a chunk has a date to guess from
+    first = dates.first_valid_index()
+    if first is None:
+        return None
+    return guess_datetime_format(str(dates[first])) or 'mixed'
+
+
+def clean_chunk(df, date_format):
+    # The parser already yields float64 for clean amounts, thousands separators
+    # included; only coerce dirty columns. One bad value leaves the whole chunk as
+    # strings, separators and all, so strip them here too.
+    if not pd.api.types.is_numeric_dtype(df['Amount']):
+        df['Amount'] = pd.to_numeric(df['Amount'].str.replace(',', '', regex=False), errors='coerce')
+    df['Date'] = pd.to_datetime(df['Date'], format=date_format, errors='coerce')
+    valid = np.isfinite(df['Amount']) & df['Date'].notna()
+    # Store whole cents so sums are exact integer reductions
+    df = df[valid].assign(Amount=lambda d: (d['Amount'] * 100).round().astype('int64'))
+    return df, int((~valid).sum())
+
+
+def file_digest(uploaded_file):
+    # Hash each upload once per session; the cached stages below are keyed on this
+    # digest and skip hashing the raw bytes (the _file_bytes argument) on every rerun
+    digests = st.session_state.setdefault('file_digests', {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+    return digests[uploaded_file.file_id]
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_and_clean(pipeline_key, digest, _file_bytes):
+    # Cached on the file contents, so reruns with the same upload skip parsing.
+    # Kept in memory only: the cleaned frame holds every transaction.
+    # Large statements are cleaned a chunk at a time, so the raw string columns
+    # never have to be held for the whole file at once.
+    chunks = []
+    invalid_count = 0
+    date_format = None
+    # Only the required columns are materialized; the tokenizer skips the rest
+    with pd.read_csv(io.BytesIO(_file_bytes), usecols=lambda col: col.strip() in REQUIRED,
+                     dtype={'Details': 'string[pyarrow]', 'Debit/Credit': 'category'},
+                     thousands=',', chunksize=CHUNK_SIZE) as reader:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip()
+            if not chunks:
+                # usecols fixes the columns for every chunk, so validate once per file
+                check_columns(chunk.columns)
+            if date_format is None:
+                date_format = guess_date_format(chunk['Date'])
+            chunk, chunk_invalid = clean_chunk(chunk, date_format)
+            chunks.append(chunk)
+            invalid_count += chunk_invalid
+    df = pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+    df['Debit/Credit'] = df['Debit/Credit'].astype('category')
+    # Lowercase Details once per file so categorization and any later text work share
+    # it; arrow-backed strings do this in one C kernel. Recurring merchants are common
+    # in bank data, so store it as categorical codes when most values repeat.
+    details_lc = df['Details'].astype('string[pyarrow]').str.lower().fillna('')
+    if len(details_lc) and details_lc.nunique() / len(details_lc) < 0.5:
+        details_lc = details_lc.astype('category')
+    df['_details_lc'] = details_lc
+    return df, invalid_count
+
+
+def debit_rows(agg):
+    return agg[agg.index.get_level_values('Debit/Credit') == 'Debit'].droplevel('Debit/Credit')
+
+
+@st.cache_data(show_spinner=False, persist='disk', max_entries=32)
+def summarize(pipeline_key, digest, keyword_items, _file_bytes):
+    # Categorize and aggregate in one cached stage: keyword edits only redo this
+    # step, and reruns get back the small summaries rather than the whole frame.
+    # Persisted to disk so re-uploading a statement after a restart skips parsing;
+    # see the README for what is kept there and how to clear it.
+    df, invalid_count = load_and_clean(pipeline_key, digest, _file_bytes)
+    df['Category'] = categorize_column(df['_details_lc'], keyword_items)
+    # Group on Debit/Credit alongside each key and slice out the Debit rows afterwards,
+    # rather than copying the expense subset of the frame
+    by_category = df.groupby(['Debit/Credit', 'Category'], observed=True)['Amount'].sum()
+    sums = by_category.groupby(level='Debit/Credit', observed=True, sort=False).sum()
+    cat_summary = debit_rows(by_category).reset_index()
+    # Bucket by month on the raw datetime64 values; format labels only after aggregating.
+    # Drop any timezone first so months follow local dates rather than UTC.
+    dates = df['Date']
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        dates = dates.dt.tz_localize(None)
+    months = dates.to_numpy().astype('datetime64[M]')
+    by_month = df.groupby(['Debit/Credit', months], observed=True)['Amount'].sum()
+    monthly_summary = debit_rows(by_month).rename_axis('Month').reset_index()
+    monthly_summary['Month'] = monthly_summary['Month'].dt.strftime('%Y-%m')
+    # Back from cents to currency units, on the aggregates only
+    cat_summary['Amount'] /= 100
+    monthly_summary['Amount'] /= 100
+    preview = df.head().drop(columns='_details_lc').assign(Amount=lambda d: d['Amount'] / 100)
+    return invalid_count, preview, sums / 100, cat_summary, monthly_summary
+
+# Streamlit keys a cached function on its own source only, not on its callees, so
+# fold every helper and setting the cached stages depend on into one key; the
+# persisted summaries then go stale as soon as any of them changes
+PIPELINE_KEY = hashlib.blake2b(repr((
+    [inspect.getsource(func) for func in (
+        keyword_signature, prune_keywords, build_automaton, categorize, build_patterns,
+        categorize_column, match_keywords, check_columns, guess_date_format, clean_chunk,
+        load_and_clean, debit_rows)],
+    REQUIRED_COLS, CHUNK_SIZE, pd.__version__,
+)).encode(), digest_size=16).hexdigest()
+
+# --- Charts ---
+# Figures are only read after construction, so st.cache_resource can hand back the
+# same object instead of paying a pickle round trip like st.cache_data would. The
+# cache is shared by every session, so only recent summaries keep their figures.
+@st.cache_resource(show_spinner=False, max_entries=32)
+def make_pie(cat_summary):
+    return px.pie(cat_summary, values='Amount', names='Category', title='Expense Distribution')
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def make_bar(cat_summary):
+    return px.bar(cat_summary, x='Category', y='Amount', title='Expenses by Category')
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def make_line(monthly_summary):
+    return px.line(monthly_summary, x='Month', y='Amount', title='Monthly Expenses Over Time')
 
 # --- Category and Keyword Management UI ---
 st.sidebar.header('Manage Categories')
@@ -43,75 +284,57 @@ with st.sidebar.expander('Current Categories & Keywords'):
 uploaded_file = st.file_uploader('Choose a CSV file', type='csv')
 if uploaded_file:
     try:
-        if hasattr(uploaded_file, 'getbuffer') and uploaded_file.getbuffer().nbytes == 0:
+        file_bytes = uploaded_file.getvalue()
+        if not file_bytes:
             st.error('Uploaded file is empty. Please upload a valid CSV file.')
         else:
+            # Use updated CATEGORY_KEYWORDS for categorization
+            keyword_items = keyword_signature(CATEGORY_KEYWORDS)
             try:
-                df = pd.read_csv(uploaded_file)
+                summary = summarize(PIPELINE_KEY, file_digest(uploaded_file), keyword_items, file_bytes)
             except pd.errors.EmptyDataError:
                 st.error('The uploaded CSV file is empty. Please select a file with data.')
-                df = None
+                summary = None
             except UnicodeDecodeError:
                 st.error('File encoding error: Please upload a UTF-8 encoded CSV file.')
-                df = None
+                summary = None
             except pd.errors.ParserError:
                 st.error('Parsing error: The CSV file appears to be malformed or corrupted.')
-                df = None
+                summary = None
+            except MissingColumnsError as e:
+                st.error(str(e))
+                summary = None
             except Exception as e:
                 st.error(f'Unexpected error loading file: {e}')
-                df = None
-            if df is not None:
-                df.columns = df.columns.str.strip()
-                required_cols = ['Date', 'Details', 'Amount', 'Debit/Credit']
-                missing_cols = [col for col in required_cols if col not in df.columns]
-                if missing_cols:
-                    st.error(f"Missing required columns: {', '.join(missing_cols)}")
-                else:
-                    df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
-                    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-                    invalid_rows = df[df['Amount'].isna() | df['Date'].isna()]
-                    if not invalid_rows.empty:
-                        st.warning(f"{len(invalid_rows)} rows were removed due to invalid date or amount.")
-                    df = df.dropna(subset=['Date', 'Amount'])
-                    # Use updated CATEGORY_KEYWORDS for categorization
-                    def categorize(details):
-                        details = str(details).lower()
-                        for category, keywords in CATEGORY_KEYWORDS.items():
-                            if any(keyword in details for keyword in keywords):
-                                return category
-                        return 'Uncategorized'
-                    df['Category'] = df['Details'].apply(categorize)
-
-                    # Summary metrics
-                    total_income = df[df['Debit/Credit'] == 'Credit']['Amount'].sum()
-                    total_expenses = df[df['Debit/Credit'] == 'Debit']['Amount'].sum()
-                    net_income = total_income - total_expenses
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric('Total Income', f"${total_income:,.2f}")
-                    col2.metric('Total Expenses', f"${total_expenses:,.2f}")
-                    col3.metric('Net Income', f"${net_income:,.2f}")
-
-                    st.write('Categorized data:')
-                    st.dataframe(df.head())
-
-                    # Category distribution visualizations
-                    expense_df = df[df['Debit/Credit'] == 'Debit']
-                    if not expense_df.empty:
-                        cat_summary = expense_df.groupby('Category')['Amount'].sum().reset_index()
-                        st.subheader('Spending by Category')
-                        col4, col5 = st.columns(2)
-                        with col4:
-                            pie_fig = px.pie(cat_summary, values='Amount', names='Category', title='Expense Distribution')
-                            st.plotly_chart(pie_fig, use_container_width=True)
-                        with col5:
-                            bar_fig = px.bar(cat_summary, x='Category', y='Amount', title='Expenses by Category')
-                            st.plotly_chart(bar_fig, use_container_width=True)
-
-                        # Time series visualization for monthly spend
-                        expense_df['Month'] = expense_df['Date'].dt.to_period('M').astype(str)
-                        monthly_summary = expense_df.groupby('Month')['Amount'].sum().reset_index()
-                        st.subheader('Monthly Spend Trend')
-                        line_fig = px.line(monthly_summary, x='Month', y='Amount', title='Monthly Expenses Over Time')
-                        st.plotly_chart(line_fig, use_container_width=True)
+                summary = None
+            if summary is not None:
+                invalid_count, preview, sums, cat_summary, monthly_summary = summary
+                if invalid_count:
+                    st.warning(f"{invalid_count} rows were removed due to invalid date or amount.")
+
+                # Summary metrics
+                total_income = sums.get('Credit', 0.0)
+                total_expenses = sums.get('Debit', 0.0)
+                net_income = total_income - total_expenses
+                col1, col2, col3 = st.columns(3)
+                col1.metric('Total Income', f"${total_income:,.2f}")
+                col2.metric('Total Expenses', f"${total_expenses:,.2f}")
+                col3.metric('Net Income', f"${net_income:,.2f}")
+
+                st.write('Categorized data:')
+                st.dataframe(preview)
+
+                # Category distribution visualizations
+                if not cat_summary.empty:
+                    st.subheader('Spending by Category')
+                    col4, col5 = st.columns(2)
+                    with col4:
+                        st.plotly_chart(make_pie(cat_summary), use_container_width=True)
+                    with col5:
+                        st.plotly_chart(make_bar(cat_summary), use_container_width=True)
+
+                    # Time series visualization for monthly spend
+                    st.subheader('Monthly Spend Trend')
+                    st.plotly_chart(make_line(monthly_summary), use_container_width=True)
     except Exception as e:
         st.error(f'Error reading or cleaning CSV: {e}')